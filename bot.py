@@ -1,21 +1,33 @@
 import asyncio
+import hashlib
+import io
+import json
 import logging
-import os
-import tempfile
+import re
+from contextlib import contextmanager
 import subprocess
+import time
 from datetime import datetime
+from typing import AsyncIterator, Optional
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import Message, Voice
 import speech_recognition as sr
-from pydub import AudioSegment
-import ffmpeg
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import case, create_engine, delete, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import sessionmaker, selectinload
 
 from config import config
-from models import Base, User, Task
+from models import (
+    Base, User, Task, TaskDailyStats, DAILY_STATS_COLUMNS, TASK_DAY, TASK_PRIORITY,
+    create_missing_indexes, refresh_task_daily_stats, task_daily_counts
+)
 from nlp_utils import extract_task_info, extract_user_mention
 
 # Configure logging
@@ -30,89 +42,277 @@ bot = Bot(token=config.BOT_TOKEN)
 dp = Dispatcher()
 
 # Database setup
-engine = create_engine(config.DATABASE_URL)
-Base.metadata.create_all(engine)
+engine_options = dict(
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    future=True,
+)
+if config.DATABASE_URL.startswith("sqlite"):
+    # Handlers share pooled connections across threads
+    engine_options["connect_args"] = {"check_same_thread": False}
+engine = create_engine(config.DATABASE_URL, **engine_options)
 SessionLocal = sessionmaker(bind=engine)
-
+inspector = inspect(engine)
+if inspector.has_table(Task.__tablename__):
+    if not inspector.has_table(TaskDailyStats.__tablename__):
+        # Roll-up added after this database was created
+        TaskDailyStats.__table__.create(engine)
+    create_missing_indexes(engine)
+    with SessionLocal() as db:
+        # Backfill an empty roll-up from tasks; checked on every start so a start
+        # that died between creating and filling the table is repaired later
+        if db.query(TaskDailyStats.day).first() is None and db.query(Task.id).first() is not None:
+            refresh_task_daily_stats(db)
+else:
+    Base.metadata.create_all(engine)
+
+# Dialect-specific INSERT constructs that support ON CONFLICT
+UPSERT_INSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgresql_insert,
+}
+
+# Telegram user id -> (users.id, expiry) for repeat senders
+USER_ID_CACHE_TTL = 300
+USER_ID_CACHE_SIZE = 10000
+user_id_cache = {}
+
+# Hash of the last command menu sent to Telegram, to skip resending it on restart
+COMMANDS_HASH_FILE = ".commands_hash"
+
+# Sample rate voice messages are resampled to before recognition
+SPEECH_SAMPLE_RATE = 16000
+
+# Read ffmpeg output in 1 MiB chunks instead of asyncio's 64 KiB default
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+# Voice files stream into ffmpeg as they download, so the two get separate limits
+VOICE_DOWNLOAD_TIMEOUT = 60.0
+FFMPEG_TIMEOUT = 10.0
+
+@contextmanager
 def get_db():
     db = SessionLocal()
     try:
         yield db
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
-async def convert_ogg_to_wav(ogg_path: str, wav_path: str) -> bool:
-    """Convert OGG to WAV using ffmpeg with timeout"""
+def cache_user_id(telegram_id: int, user_id: int):
+    """Remember the users.id of a Telegram user for USER_ID_CACHE_TTL seconds"""
+    # Re-inserting moves the user to the end, so eviction drops the least recently cached
+    if user_id_cache.pop(telegram_id, None) is None and len(user_id_cache) >= USER_ID_CACHE_SIZE:
+        # Evict the oldest entry
+        del user_id_cache[next(iter(user_id_cache))]
+    user_id_cache[telegram_id] = (user_id, time.monotonic() + USER_ID_CACHE_TTL)
+
+def cached_user_id(telegram_id: int) -> Optional[int]:
+    """Return the cached users.id of a Telegram user without touching the database"""
+    cached = user_id_cache.get(telegram_id)
+    if cached and cached[1] > time.monotonic():
+        # Move to the end so active users are evicted last
+        user_id_cache[telegram_id] = user_id_cache.pop(telegram_id)
+        return cached[0]
+    return None
+
+def get_user_id(db: Session, telegram_id: int) -> Optional[int]:
+    """Return the users.id of a Telegram user, or None if they are not registered"""
+    user_id = cached_user_id(telegram_id)
+    if user_id is not None:
+        return user_id
+    user_id = db.execute(select(User.id).where(User.telegram_id == telegram_id)).scalar_one_or_none()
+    if user_id is not None:
+        cache_user_id(telegram_id, user_id)
+    return user_id
+
+def register_user(db: Session, telegram_id: int, username: Optional[str]) -> int:
+    """Insert a Telegram user unless already registered and return their users.id"""
+    dialect = db.get_bind().dialect
+    insert = UPSERT_INSERTS.get(dialect.name)
+    user_id = None
+    if insert is None:
+        user_id = db.execute(select(User.id).where(User.telegram_id == telegram_id)).scalar_one_or_none()
+        if user_id is None:
+            user = User(telegram_id=telegram_id, username=username)
+            db.add(user)
+            db.commit()
+            user_id = user.id
+    else:
+        # Single atomic statement, safe against concurrent /start from the same user
+        statement = (
+            insert(User)
+            .values(telegram_id=telegram_id, username=username)
+            .on_conflict_do_nothing(index_elements=[User.telegram_id])
+        )
+        # RETURNING needs SQLite 3.35+; older builds look the id up afterwards
+        if dialect.insert_returning:
+            user_id = db.execute(statement.returning(User.id)).scalar_one_or_none()
+        else:
+            db.execute(statement)
+        db.commit()
+        if user_id is None:
+            user_id = db.execute(select(User.id).where(User.telegram_id == telegram_id)).scalar_one()
+    cache_user_id(telegram_id, user_id)
+    return user_id
+
+def add_task_to_daily_stats(db: Session, task_id: int):
+    """Count a newly inserted task in the task_daily_stats roll-up (the caller commits)"""
+    counts = task_daily_counts().where(Task.id == task_id)
+    insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        if update_daily_stats_for_task(db, task_id, 1) == 0:
+            db.execute(TaskDailyStats.__table__.insert().from_select(DAILY_STATS_COLUMNS, counts))
+        return
+    statement = insert(TaskDailyStats).from_select(DAILY_STATS_COLUMNS, counts)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[TaskDailyStats.day, TaskDailyStats.priority],
+        set_={
+            'created_count': TaskDailyStats.created_count + statement.excluded.created_count,
+            'completed_count': TaskDailyStats.completed_count + statement.excluded.completed_count,
+        }
+    ))
+
+def update_daily_stats_for_task(db: Session, task_id: int, sign: int) -> int:
+    """Add (sign=1) or subtract (sign=-1) a task in its existing roll-up row; return rows matched"""
+    day = select(TASK_DAY).where(Task.id == task_id).scalar_subquery()
+    priority = select(TASK_PRIORITY).where(Task.id == task_id).scalar_subquery()
+    completed = select(case((Task.is_completed == True, 1), else_=0)).where(Task.id == task_id).scalar_subquery()
+    matched = db.execute(
+        update(TaskDailyStats)
+        .where(TaskDailyStats.day == day, TaskDailyStats.priority == priority)
+        .values(
+            created_count=TaskDailyStats.created_count + sign,
+            completed_count=TaskDailyStats.completed_count + sign * completed
+        )
+    ).rowcount
+    if sign < 0:
+        # Drop emptied rows so the charts do not show zero-sized buckets
+        db.execute(
+            delete(TaskDailyStats)
+            .where(TaskDailyStats.day == day, TaskDailyStats.priority == priority)
+            .where(TaskDailyStats.created_count == 0)
+        )
+    return matched
+
+def enlarge_pipe_buffers(process: asyncio.subprocess.Process):
+    """Grow the OS buffers of the ffmpeg stdin/stdout pipes where supported (Linux)"""
+    if not hasattr(fcntl, "F_SETPIPE_SZ"):
+        return
+    for fd in (0, 1):
+        try:
+            pipe = process._transport.get_pipe_transport(fd).get_extra_info('pipe')
+            fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not resize ffmpeg pipe buffer: {e}")
+
+async def stream_voice(voice: Voice) -> AsyncIterator[bytes]:
+    """Yield the voice file from Telegram chunk by chunk as it downloads"""
+    file = await bot.get_file(voice.file_id)
+    if bot.session.api.is_local:
+        # A local Bot API server exposes files on disk, not over HTTP;
+        # let aiogram map and read the path
+        yield (await bot.download_file(file.file_path)).getvalue()
+        return
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url=url, chunk_size=PIPE_BUFFER_SIZE):
+        yield chunk
+
+async def convert_ogg_to_wav(ogg_chunks: AsyncIterator[bytes]) -> Optional[bytes]:
+    """Convert streamed OGG to WAV in memory by piping through ffmpeg with timeout"""
     try:
-        # Use subprocess instead of ffmpeg-python for better control
         process = await asyncio.create_subprocess_exec(
-            'ffmpeg', '-y', '-i', ogg_path, wav_path,
+            'ffmpeg', '-loglevel', 'error', '-i', 'pipe:0',
+            # 16 kHz mono is all speech recognition needs and keeps the upload small
+            '-ac', '1', '-ar', str(SPEECH_SAMPLE_RATE), '-acodec', 'pcm_s16le',
+            '-f', 'wav', 'pipe:1',
+            stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stderr=subprocess.PIPE,
+            limit=PIPE_BUFFER_SIZE
         )
+        enlarge_pipe_buffers(process)
+        
+        async def feed_stdin():
+            # Pass chunks to ffmpeg while the rest is still downloading
+            try:
+                async for chunk in ogg_chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg exited early, its return code reports why
+                pass
+            finally:
+                process.stdin.close()
         
+        # Drain ffmpeg's output while feeding it so neither pipe fills up
+        output = asyncio.gather(process.stdout.read(), process.stderr.read())
         try:
-            # Wait for process with timeout
-            await asyncio.wait_for(process.communicate(), timeout=10.0)
-            return process.returncode == 0
+            await asyncio.wait_for(feed_stdin(), timeout=VOICE_DOWNLOAD_TIMEOUT)
         except asyncio.TimeoutError:
             process.kill()
+            # The pipes close once ffmpeg is killed, so the pending reads finish
+            await output
+            await process.wait()
+            logger.error("Voice download timed out")
+            return None
+        
+        try:
+            # Wait for process with timeout, counted from the end of the download
+            wav_data, stderr = await asyncio.wait_for(output, timeout=FFMPEG_TIMEOUT)
+            await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
             logger.error("FFmpeg conversion timed out")
-            return False
+            return None
+        
+        if process.returncode != 0:
+            logger.error(f"FFmpeg conversion failed: {stderr.decode(errors='replace')}")
+            return None
+        return wav_data
     except Exception as e:
         logger.error(f"Error in convert_ogg_to_wav: {e}")
-        return False
+        return None
+
+def recognize_speech(wav_data: bytes) -> str:
+    """Run Google speech recognition on WAV data (blocking)"""
+    recognizer = sr.Recognizer()
+    with sr.AudioFile(io.BytesIO(wav_data)) as source:
+        logger.info("Reading audio data")
+        audio_data = recognizer.record(source)
+    logger.info("Sending to Google Speech Recognition")
+    return recognizer.recognize_google(audio_data, language='ru-RU')
 
 async def convert_voice_to_text(voice: Voice) -> str:
     """Convert voice message to text using speech recognition"""
     try:
         logger.info("Starting voice message processing")
         
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as ogg_file, \
-             tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as wav_file:
-            
-            logger.info("Downloading voice file")
-            # Download voice file
-            voice_file = await bot.download(voice)
-            ogg_file.write(voice_file.read())
-            ogg_file.flush()
-            logger.info(f"Voice file saved to {ogg_file.name}")
-            
-            try:
-                logger.info("Converting OGG to WAV")
-                # Convert ogg to wav using ffmpeg with timeout
-                if not await convert_ogg_to_wav(ogg_file.name, wav_file.name):
-                    logger.error("Failed to convert OGG to WAV")
-                    return None
-                
-                logger.info(f"WAV file saved to {wav_file.name}")
-                
-                # Recognize speech
-                logger.info("Starting speech recognition")
-                recognizer = sr.Recognizer()
-                with sr.AudioFile(wav_file.name) as source:
-                    logger.info("Reading audio file")
-                    audio_data = recognizer.record(source)
-                    logger.info("Sending to Google Speech Recognition")
-                    try:
-                        text = recognizer.recognize_google(audio_data, language='ru-RU')
-                        logger.info(f"Successfully recognized text: {text}")
-                        return text
-                    except sr.UnknownValueError:
-                        logger.error("Speech recognition could not understand audio")
-                        return None
-                    except sr.RequestError as e:
-                        logger.error(f"Could not request results from speech recognition service: {e}")
-                        return None
-            finally:
-                # Clean up temporary files
-                logger.info("Cleaning up temporary files")
-                try:
-                    os.unlink(ogg_file.name)
-                    os.unlink(wav_file.name)
-                except Exception as e:
-                    logger.error(f"Error cleaning up files: {e}")
+        logger.info("Downloading and converting OGG to WAV")
+        # Stream the download into ffmpeg so both run concurrently
+        wav_data = await convert_ogg_to_wav(stream_voice(voice))
+        if not wav_data:
+            logger.error("Failed to convert OGG to WAV")
+            return None
+        
+        # Recognize speech off the event loop, the Google request is blocking
+        logger.info("Starting speech recognition")
+        try:
+            text = await asyncio.to_thread(recognize_speech, wav_data)
+            logger.info(f"Successfully recognized text: {text}")
+            return text
+        except sr.UnknownValueError:
+            logger.error("Speech recognition could not understand audio")
+            return None
+        except sr.RequestError as e:
+            logger.error(f"Could not request results from speech recognition service: {e}")
+            return None
     except Exception as e:
         logger.error(f"Error in convert_voice_to_text: {e}", exc_info=True)
         return None
@@ -120,16 +320,9 @@ async def convert_voice_to_text(voice: Voice) -> str:
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     """Handle the /start command"""
-    db = next(get_db())
-    user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-    
-    if not user:
-        user = User(
-            telegram_id=message.from_user.id,
-            username=message.from_user.username
-        )
-        db.add(user)
-        db.commit()
+    if cached_user_id(message.from_user.id) is None:
+        with get_db() as db:
+            register_user(db, message.from_user.id, message.from_user.username)
     
     await message.answer(
         "👋 Привет! Я бот для управления задачами.\n\n"
@@ -164,35 +357,44 @@ async def cmd_help(message: Message):
 @dp.message(Command("created_tasks"))
 async def show_created_tasks(message: Message):
     """Show tasks created by the user"""
-    db = next(get_db())
-    user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-    
-    if not user:
-        await message.answer("Вы еще не создали ни одной задачи.", reply_markup=types.ReplyKeyboardRemove())
-        return
+    # The reply is built inside the session and sent after it is closed, so the
+    # pooled connection is not held while waiting on Telegram
+    with get_db() as db:
+        user_id = get_user_id(db, message.from_user.id)
     
-    tasks = user.created_tasks
-    
-    if not tasks:
-        await message.answer("У вас нет созданных задач.", reply_markup=types.ReplyKeyboardRemove())
-        return
+        if user_id is None:
+            reply = "Вы еще не создали ни одной задачи."
+        else:
+            tasks = (
+                db.query(Task)
+                .options(selectinload(Task.assignee))
+                .filter(Task.creator_id == user_id)
+                .all()
+            )
     
-    response = "📋 Задачи, созданные вами:\n\n"
-    for task in tasks:
-        status_emoji = "✅" if task.is_completed else "⏳"
-        response += f"{status_emoji} #{task.id} {task.title}\n"
-        if task.description:
-            response += f"   📝 {task.description}\n"
-        if task.due_date:
-            response += f"   ⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n"
-        response += f"   🎯 Приоритет: {task.priority}\n"
-        if task.assignee:
-            response += f"   👤 Исполнитель: @{task.assignee.username}\n"
-        response += "\n"
+            if not tasks:
+                reply = "У вас нет созданных задач."
+            else:
+                parts = ["📋 Задачи, созданные вами:\n\n"]
+                for task in tasks:
+                    status_emoji = "✅" if task.is_completed else "⏳"
+                    parts.append(f"{status_emoji} #{task.id} {task.title}\n")
+                    if task.description:
+                        parts.append(f"   📝 {task.description}\n")
+                    if task.due_date:
+                        parts.append(f"   ⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n")
+                    parts.append(f"   🎯 Приоритет: {task.priority}\n")
+                    if task.assignee:
+                        parts.append(f"   👤 Исполнитель: @{task.assignee.username}\n")
+                    parts.append("\n")
+                reply = "".join(parts)
     
-    await message.answer(response, reply_markup=types.ReplyKeyboardRemove())
+    await message.answer(reply, reply_markup=types.ReplyKeyboardRemove())
 
-@dp.message(lambda message: message.text and any(phrase in message.text.lower() for phrase in ["создать задачу", "новая задача", "задача:"]))
+# Phrases that mark a text message as a task creation request
+TASK_TRIGGER_PATTERN = re.compile(r"создать задачу|новая задача|задача:", re.IGNORECASE)
+
+@dp.message(lambda message: message.text and TASK_TRIGGER_PATTERN.search(message.text))
 async def create_task(message: Message):
     """Handle natural language task creation"""
     await process_task_creation(message, message.text)
@@ -228,46 +430,50 @@ async def process_task_creation(message: Message, text: str):
     """Process task creation from text"""
     try:
         logger.info(f"Processing task creation with text: {text}")
-        db = next(get_db())
-        
-        # Get or create user
-        user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            user = User(telegram_id=message.from_user.id, username=message.from_user.username)
-            db.add(user)
-            db.commit()
-        
         # Extract task information
         title, description, due_date, priority = extract_task_info(text)
         assignee_username = extract_user_mention(text)
         
-        # Create task
-        task = Task(
-            title=title,
-            description=description,
-            due_date=due_date,
-            priority=priority,
-            creator_id=user.id
-        )
+        with get_db() as db:
+            # Get or create user
+            user_id = cached_user_id(message.from_user.id)
+            if user_id is None:
+                user_id = register_user(db, message.from_user.id, message.from_user.username)
         
-        if assignee_username:
-            assignee = db.query(User).filter(User.username == assignee_username).first()
-            if assignee:
-                task.assignee_id = assignee.id
+            # Create task
+            task = Task(
+                title=title,
+                description=description,
+                due_date=due_date,
+                priority=priority,
+                creator_id=user_id
+            )
         
-        db.add(task)
-        db.commit()
+            if assignee_username:
+                task.assignee_id = db.execute(
+                    select(User.id)
+                    .where(User.username == assignee_username)
+                    # A reassigned username may still be stored on an older account
+                    .order_by(User.id.desc())
+                    .limit(1)
+                ).scalar_one_or_none()
+        
+            db.add(task)
+            db.flush()
+            add_task_to_daily_stats(db, task.id)
+            db.commit()
         
-        # Prepare response message
-        response = f"✅ Задача создана:\n\n"
-        response += f"📌 {task.title}\n"
-        if task.description:
-            response += f"📝 {task.description}\n"
-        if task.due_date:
-            response += f"⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n"
-        response += f"🎯 Приоритет: {task.priority}\n"
+            # Prepare response message
+            parts = [f"✅ Задача создана:\n\n"]
+            parts.append(f"📌 {task.title}\n")
+            if task.description:
+                parts.append(f"📝 {task.description}\n")
+            if task.due_date:
+                parts.append(f"⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n")
+            parts.append(f"🎯 Приоритет: {task.priority}\n")
+            reply = "".join(parts)
         
-        await message.answer(response)
+        await message.answer(reply)
     except Exception as e:
         logger.error(f"Error in process_task_creation: {e}", exc_info=True)
         await message.answer("❌ Произошла ошибка при создании задачи. Пожалуйста, попробуйте еще раз.")
@@ -275,32 +481,88 @@ async def process_task_creation(message: Message, text: str):
 @dp.message(Command("mytasks"))
 async def show_my_tasks(message: Message):
     """Show tasks assigned to the user"""
-    db = next(get_db())
-    user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
+    with get_db() as db:
+        user_id = get_user_id(db, message.from_user.id)
     
-    if not user:
-        await message.answer("Вы еще не создали ни одной задачи.", reply_markup=types.ReplyKeyboardRemove())
-        return
-    
-    # Get tasks where user is assignee
-    tasks = db.query(Task).filter(Task.assignee_id == user.id).all()
-    
-    if not tasks:
-        await message.answer("У вас нет назначенных задач.", reply_markup=types.ReplyKeyboardRemove())
-        return
+        if user_id is None:
+            reply = "Вы еще не создали ни одной задачи."
+        else:
+            # Get tasks where user is assignee
+            tasks = (
+                db.query(Task)
+                .options(selectinload(Task.creator))
+                .filter(Task.assignee_id == user_id)
+                .all()
+            )
     
-    response = "📋 Ваши задачи:\n\n"
-    for task in tasks:
-        status_emoji = "✅" if task.is_completed else "⏳"
-        response += f"{status_emoji} #{task.id} {task.title}\n"
-        if task.description:
-            response += f"   📝 {task.description}\n"
-        if task.due_date:
-            response += f"   ⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n"
-        response += f"   🎯 Приоритет: {task.priority}\n"
-        response += f"   👤 Создатель: @{task.creator.username}\n\n"
+            if not tasks:
+                reply = "У вас нет назначенных задач."
+            else:
+                parts = ["📋 Ваши задачи:\n\n"]
+                for task in tasks:
+                    status_emoji = "✅" if task.is_completed else "⏳"
+                    parts.append(f"{status_emoji} #{task.id} {task.title}\n")
+                    if task.description:
+                        parts.append(f"   📝 {task.description}\n")
+                    if task.due_date:
+                        parts.append(f"   ⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n")
+                    parts.append(f"   🎯 Приоритет: {task.priority}\n")
+                    parts.append(f"   👤 Создатель: @{task.creator.username}\n\n")
+                reply = "".join(parts)
     
-    await message.answer(response, reply_markup=types.ReplyKeyboardRemove())
+    await message.answer(reply, reply_markup=types.ReplyKeyboardRemove())
+
+def assign_task_in_db(db: Session, telegram_id: int, task_id: int, assignee_username: str, from_username: Optional[str]) -> tuple[str, Optional[tuple[int, str]]]:
+    """Assign a task and return the reply plus an optional (chat_id, text) notification"""
+    # Get current user
+    current_user_id = get_user_id(db, telegram_id)
+    if current_user_id is None:
+        return "❌ Пользователь не найден в базе данных.", None
+
+    # Get task
+    task = db.get(Task, task_id)
+    if not task:
+        return "❌ Задача не найдена.", None
+
+    # Check if user is the creator of the task
+    if task.creator_id != current_user_id:
+        return (
+            "❌ Вы можете назначать только те задачи, которые создали сами.\n"
+            f"ID создателя задачи: {task.creator_id}\n"
+            f"Ваш ID: {current_user_id}"
+        ), None
+
+    # Get assignee
+    assignee = (
+        db.query(User)
+        .filter(User.username == assignee_username)
+        .order_by(User.id.desc())
+        .first()
+    )
+    if not assignee:
+        return f"❌ Пользователь @{assignee_username} не найден.", None
+
+    # Assign task
+    task.assignee_id = assignee.id
+    db.commit()
+
+    # Prepare response
+    parts = [f"✅ Задача назначена:\n\n"]
+    parts.append(f"📌 {task.title}\n")
+    if task.description:
+        parts.append(f"📝 {task.description}\n")
+    if task.due_date:
+        parts.append(f"⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n")
+    parts.append(f"🎯 Приоритет: {task.priority}\n")
+    parts.append(f"👤 Исполнитель: @{assignee.username}")
+
+    notification = (
+        assignee.telegram_id,
+        f"📬 Вам назначена новая задача:\n\n"
+        f"📌 {task.title}\n"
+        f"👤 От: @{from_username}"
+    )
+    return "".join(parts), notification
 
 @dp.message(Command("assign"))
 async def assign_task(message: Message):
@@ -317,71 +579,54 @@ async def assign_task(message: Message):
             )
             return
 
-        task_id = args[1]
-        assignee_username = args[2].lstrip('@')
-
-        db = next(get_db())
-        
-        # Get current user
-        current_user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not current_user:
-            await message.answer("❌ Пользователь не найден в базе данных.", reply_markup=types.ReplyKeyboardRemove())
-            return
-
-        # Get task
-        task = db.query(Task).filter(Task.id == task_id).first()
-        if not task:
-            await message.answer("❌ Задача не найдена.", reply_markup=types.ReplyKeyboardRemove())
+        try:
+            task_id = int(args[1])
+        except ValueError:
+            await message.answer("❌ ID задачи должен быть числом.", reply_markup=types.ReplyKeyboardRemove())
             return
+        assignee_username = args[2].lstrip('@')
 
-        # Check if user is the creator of the task
-        if task.creator_id != current_user.id:
-            await message.answer(
-                "❌ Вы можете назначать только те задачи, которые создали сами.\n"
-                f"ID создателя задачи: {task.creator_id}\n"
-                f"Ваш ID: {current_user.id}",
-                reply_markup=types.ReplyKeyboardRemove()
+        # The session is closed before any Telegram call is awaited
+        with get_db() as db:
+            reply, notification = assign_task_in_db(
+                db, message.from_user.id, task_id, assignee_username, message.from_user.username
             )
-            return
-
-        # Get assignee
-        assignee = db.query(User).filter(User.username == assignee_username).first()
-        if not assignee:
-            await message.answer(f"❌ Пользователь @{assignee_username} не найден.", reply_markup=types.ReplyKeyboardRemove())
-            return
 
-        # Assign task
-        task.assignee_id = assignee.id
-        db.commit()
-
-        # Prepare response
-        response = f"✅ Задача назначена:\n\n"
-        response += f"📌 {task.title}\n"
-        if task.description:
-            response += f"📝 {task.description}\n"
-        if task.due_date:
-            response += f"⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n"
-        response += f"🎯 Приоритет: {task.priority}\n"
-        response += f"👤 Исполнитель: @{assignee.username}"
-
-        await message.answer(response, reply_markup=types.ReplyKeyboardRemove())
+        await message.answer(reply, reply_markup=types.ReplyKeyboardRemove())
 
         # Notify assignee
-        try:
-            await bot.send_message(
-                assignee.telegram_id,
-                f"📬 Вам назначена новая задача:\n\n"
-                f"📌 {task.title}\n"
-                f"👤 От: @{message.from_user.username}",
-                reply_markup=types.ReplyKeyboardRemove()
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify assignee: {e}")
+        if notification:
+            try:
+                await bot.send_message(*notification, reply_markup=types.ReplyKeyboardRemove())
+            except Exception as e:
+                logger.error(f"Failed to notify assignee: {e}")
 
     except Exception as e:
         logger.error(f"Error in assign_task: {e}", exc_info=True)
         await message.answer("❌ Произошла ошибка при назначении задачи. Пожалуйста, попробуйте еще раз.", reply_markup=types.ReplyKeyboardRemove())
 
+def delete_task_in_db(db: Session, telegram_id: int, task_id: int) -> str:
+    """Delete a task created by the user and return the reply"""
+    # Get current user
+    current_user_id = get_user_id(db, telegram_id)
+    if current_user_id is None:
+        return "❌ Пользователь не найден в базе данных."
+
+    # Get task
+    task = db.get(Task, task_id)
+    if not task:
+        return "❌ Задача не найдена."
+
+    # Check if user is the creator of the task
+    if task.creator_id != current_user_id:
+        return "❌ Вы можете удалять только те задачи, которые создали сами."
+
+    # Delete task, uncounting it from the roll-up first while its row still exists
+    update_daily_stats_for_task(db, task_id, -1)
+    db.delete(task)
+    db.commit()
+    return f"✅ Задача #{task_id} успешно удалена."
+
 @dp.message(Command("delete"))
 async def delete_task(message: Message):
     """Delete a task"""
@@ -397,36 +642,61 @@ async def delete_task(message: Message):
             )
             return
 
-        task_id = args[1]
-        db = next(get_db())
-        
-        # Get current user
-        current_user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not current_user:
-            await message.answer("❌ Пользователь не найден в базе данных.", reply_markup=types.ReplyKeyboardRemove())
-            return
-
-        # Get task
-        task = db.query(Task).filter(Task.id == task_id).first()
-        if not task:
-            await message.answer("❌ Задача не найдена.", reply_markup=types.ReplyKeyboardRemove())
-            return
-
-        # Check if user is the creator of the task
-        if task.creator_id != current_user.id:
-            await message.answer("❌ Вы можете удалять только те задачи, которые создали сами.", reply_markup=types.ReplyKeyboardRemove())
+        try:
+            task_id = int(args[1])
+        except ValueError:
+            await message.answer("❌ ID задачи должен быть числом.", reply_markup=types.ReplyKeyboardRemove())
             return
+        with get_db() as db:
+            reply = delete_task_in_db(db, message.from_user.id, task_id)
 
-        # Delete task
-        db.delete(task)
-        db.commit()
-
-        await message.answer(f"✅ Задача #{task.id} успешно удалена.", reply_markup=types.ReplyKeyboardRemove())
+        await message.answer(reply, reply_markup=types.ReplyKeyboardRemove())
 
     except Exception as e:
         logger.error(f"Error in delete_task: {e}", exc_info=True)
         await message.answer("❌ Произошла ошибка при удалении задачи. Пожалуйста, попробуйте еще раз.", reply_markup=types.ReplyKeyboardRemove())
 
+def edit_task_in_db(db: Session, telegram_id: int, task_id: int, new_title: str, from_username: Optional[str]) -> tuple[str, Optional[tuple[int, str]]]:
+    """Rename a task and return the reply plus an optional (chat_id, text) notification"""
+    # Get current user
+    current_user_id = get_user_id(db, telegram_id)
+    if current_user_id is None:
+        return "❌ Пользователь не найден в базе данных.", None
+
+    # Get task
+    task = db.get(Task, task_id)
+    if not task:
+        return "❌ Задача не найдена.", None
+
+    # Check if user is the creator of the task
+    if task.creator_id != current_user_id:
+        return "❌ Вы можете редактировать только те задачи, которые создали сами.", None
+
+    # Update task
+    old_title = task.title
+    task.title = new_title
+    db.commit()
+
+    # Prepare response
+    parts = [f"✅ Задача обновлена:\n\n"]
+    parts.append(f"📌 Старое название: {old_title}\n")
+    parts.append(f"📌 Новое название: {task.title}\n")
+    if task.description:
+        parts.append(f"📝 {task.description}\n")
+    if task.due_date:
+        parts.append(f"⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n")
+    parts.append(f"🎯 Приоритет: {task.priority}\n")
+    notification = None
+    if task.assignee:
+        parts.append(f"👤 Исполнитель: @{task.assignee.username}")
+        notification = (
+            task.assignee.telegram_id,
+            f"📝 Задача обновлена:\n\n"
+            f"📌 {task.title}\n"
+            f"👤 От: @{from_username}"
+        )
+    return "".join(parts), notification
+
 @dp.message(Command("edit"))
 async def edit_task(message: Message):
     """Edit a task"""
@@ -442,57 +712,24 @@ async def edit_task(message: Message):
             )
             return
 
-        task_id = args[1]
+        try:
+            task_id = int(args[1])
+        except ValueError:
+            await message.answer("❌ ID задачи должен быть числом.", reply_markup=types.ReplyKeyboardRemove())
+            return
         new_title = args[2]
         
-        db = next(get_db())
-        
-        # Get current user
-        current_user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not current_user:
-            await message.answer("❌ Пользователь не найден в базе данных.", reply_markup=types.ReplyKeyboardRemove())
-            return
-
-        # Get task
-        task = db.query(Task).filter(Task.id == task_id).first()
-        if not task:
-            await message.answer("❌ Задача не найдена.", reply_markup=types.ReplyKeyboardRemove())
-            return
-
-        # Check if user is the creator of the task
-        if task.creator_id != current_user.id:
-            await message.answer("❌ Вы можете редактировать только те задачи, которые создали сами.", reply_markup=types.ReplyKeyboardRemove())
-            return
-
-        # Update task
-        old_title = task.title
-        task.title = new_title
-        db.commit()
-
-        # Prepare response
-        response = f"✅ Задача обновлена:\n\n"
-        response += f"📌 Старое название: {old_title}\n"
-        response += f"📌 Новое название: {task.title}\n"
-        if task.description:
-            response += f"📝 {task.description}\n"
-        if task.due_date:
-            response += f"⏰ Срок: {task.due_date.strftime('%d.%m.%Y')}\n"
-        response += f"🎯 Приоритет: {task.priority}\n"
-        if task.assignee:
-            response += f"👤 Исполнитель: @{task.assignee.username}"
+        with get_db() as db:
+            reply, notification = edit_task_in_db(
+                db, message.from_user.id, task_id, new_title, message.from_user.username
+            )
 
-        await message.answer(response, reply_markup=types.ReplyKeyboardRemove())
+        await message.answer(reply, reply_markup=types.ReplyKeyboardRemove())
 
         # Notify assignee if exists
-        if task.assignee:
+        if notification:
             try:
-                await bot.send_message(
-                    task.assignee.telegram_id,
-                    f"📝 Задача обновлена:\n\n"
-                    f"📌 {task.title}\n"
-                    f"👤 От: @{message.from_user.username}",
-                    reply_markup=types.ReplyKeyboardRemove()
-                )
+                await bot.send_message(*notification, reply_markup=types.ReplyKeyboardRemove())
             except Exception as e:
                 logger.error(f"Failed to notify assignee: {e}")
 
@@ -500,6 +737,14 @@ async def edit_task(message: Message):
         logger.error(f"Error in edit_task: {e}", exc_info=True)
         await message.answer("❌ Произошла ошибка при редактировании задачи. Пожалуйста, попробуйте еще раз.", reply_markup=types.ReplyKeyboardRemove())
 
+def read_commands_hash() -> Optional[str]:
+    """Return the hash of the command menu last sent to Telegram, if any"""
+    try:
+        with open(COMMANDS_HASH_FILE) as f:
+            return f.read()
+    except OSError:
+        return None
+
 async def main():
     # Set up commands menu
     commands = [
@@ -510,7 +755,18 @@ async def main():
         types.BotCommand(command="edit", description="Изменить название задачи"),
         types.BotCommand(command="help", description="Показать справку")
     ]
-    await bot.set_my_commands(commands)
+    # Keyed by bot id so switching BOT_TOKEN to another bot resends the menu
+    commands_hash = hashlib.blake2b(
+        json.dumps([bot.id, [command.model_dump() for command in commands]]).encode()
+    ).hexdigest()
+    if read_commands_hash() != commands_hash:
+        await bot.set_my_commands(commands)
+        try:
+            with open(COMMANDS_HASH_FILE, "w") as f:
+                f.write(commands_hash)
+        except OSError as e:
+            # Only an optimisation; the menu is simply resent on the next start
+            logger.warning(f"Could not save commands hash: {e}")
     
     # Start polling
     await dp.start_polling(bot)
@@ -8,6 +8,9 @@ load_dotenv()
 class Config:
     BOT_TOKEN: str = os.getenv("BOT_TOKEN")
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///tasks.db")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    WEB_WORKERS: int = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
     ADMIN_IDS: list[int] = field(default_factory=lambda: [int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id])
 
 config = Config() 
\ No newline at end of file
@@ -1,7 +1,7 @@
-from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import create_engine, func, case, delete, insert, literal_column, select, Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import CreateIndex
 
 Base = declarative_base()
 
@@ -9,9 +9,10 @@ class User(Base):
     __tablename__ = 'users'
     
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True)
-    username = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    telegram_id = Column(Integer, unique=True, index=True)
+    # Not unique: Telegram usernames can be given up and taken by another account
+    username = Column(String, index=True)
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), nullable=False)
     
     # Tasks where user is assignee
     assigned_tasks = relationship("Task", 
@@ -25,11 +26,19 @@ class User(Base):
 
 class Task(Base):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Lookups by creator/assignee use the leading column, dashboard counts
+        # of completed tasks are answered from the index alone
+        Index('ix_tasks_creator_completed', 'creator_id', 'is_completed'),
+        Index('ix_tasks_assignee_completed', 'assignee_id', 'is_completed'),
+        Index('ix_tasks_priority', 'priority'),
+        Index('ix_tasks_created_at', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     description = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), nullable=False)
     due_date = Column(DateTime)
     status = Column(String, default="pending")  # pending, in_progress, completed
     priority = Column(String, default="medium")  # low, medium, high
@@ -38,4 +47,48 @@ class Task(Base):
     is_completed = Column(Boolean, default=False)
     
     assignee = relationship("User", back_populates="assigned_tasks", foreign_keys=[assignee_id])
-    creator = relationship("User", back_populates="created_tasks", foreign_keys=[creator_id]) 
\ No newline at end of file
+    creator = relationship("User", back_populates="created_tasks", foreign_keys=[creator_id]) 
+
+# Day buckets for the dashboard timeline, so grouping by date(created_at) reads the
+# index instead of scanning and sorting the table. PostgreSQL rejects date() on a
+# timestamptz in an index (not immutable), so it keeps using ix_tasks_created_at.
+Index('ix_tasks_created_day', func.date(Task.created_at)).ddl_if(dialect='sqlite')
+
+class TaskDailyStats(Base):
+    """Per-day, per-priority task counts read by the dashboard instead of scanning tasks"""
+    __tablename__ = 'task_daily_stats'
+    
+    day = Column(Date, primary_key=True)
+    priority = Column(String, primary_key=True)
+    created_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+
+# Roll-up key of a task; tasks without a priority count under the column default
+TASK_DAY = func.date(Task.created_at)
+TASK_PRIORITY = func.coalesce(Task.priority, literal_column("'medium'"))
+DAILY_STATS_COLUMNS = ['day', 'priority', 'created_count', 'completed_count']
+
+def task_daily_counts():
+    """SELECT of task_daily_stats rows computed from tasks; add a WHERE to narrow it"""
+    return select(
+        TASK_DAY,
+        TASK_PRIORITY,
+        func.count(Task.id),
+        func.count(case((Task.is_completed == True, Task.id)))
+    ).group_by(TASK_DAY, TASK_PRIORITY)
+
+def refresh_task_daily_stats(db):
+    """Rebuild the task_daily_stats roll-up from tasks in one transaction."""
+    db.execute(delete(TaskDailyStats))
+    db.execute(insert(TaskDailyStats).from_select(DAILY_STATS_COLUMNS, task_daily_counts()))
+    db.commit()
+
+def create_missing_indexes(engine):
+    """Create indexes added after the tables already existed (create_all skips them)."""
+    # IF NOT EXISTS instead of checkfirst: reflection skips expression indexes such
+    # as ix_tasks_created_day, so checkfirst would try to create them again
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                # Invoked as a DDL callable so ddl_if dialect conditions still apply
+                CreateIndex(index, if_not_exists=True)(index, conn)
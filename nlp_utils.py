@@ -1,64 +1,54 @@
-import spacy
 from datetime import datetime, timedelta
 import re
 from typing import Tuple, Optional
 
-# Load Russian language model
-try:
-    nlp = spacy.load("ru_core_news_sm")
-except OSError:
-    print("Russian model not found. Please install it using: python -m spacy download ru_core_news_sm")
-    raise
+# Due date patterns paired with a resolver returning the date (or None when
+# the phrase is recognized but not yet converted to a date)
+DATE_PATTERNS = [
+    (re.compile(r'к (\d{1,2}(?:ому|ому|ому|ому)? [А-Яа-я]+)'), lambda match: None),
+    (re.compile(r'до (\d{1,2}(?:ого|ого|ого|ого)? [А-Яа-я]+)'), lambda match: None),
+    (re.compile(r'завтра'), lambda match: datetime.now() + timedelta(days=1)),
+    (re.compile(r'на следующей неделе'), lambda match: datetime.now() + timedelta(days=7)),
+    (re.compile(r'через (\d+) (?:день|дня|дней)'), lambda match: datetime.now() + timedelta(days=int(match.group(1)))),
+    (re.compile(r'через (\d+) (?:неделю|недели|недель)'), lambda match: datetime.now() + timedelta(weeks=int(match.group(1)))),
+]
+
+PRIORITY_INDICATORS = {
+    "high": ["срочно", "срочная", "важно", "важная", "высокий приоритет", "приоритетная"],
+    "low": ["низкий приоритет", "не срочно", "когда будет время", "не приоритетная"]
+}
+
+# One alternation per priority so each class is checked in a single pass
+PRIORITY_PATTERNS = {
+    p: re.compile("|".join(map(re.escape, indicators)))
+    for p, indicators in PRIORITY_INDICATORS.items()
+}
+
+MENTION_PATTERN = re.compile(r'@(\w+)')
 
 def extract_task_info(text: str) -> Tuple[str, str, Optional[datetime], str]:
     """
     Extract task information from natural language text.
     Returns: (title, description, due_date, priority)
     """
-    doc = nlp(text)
-    
-    # Extract title (first sentence)
-    title = text.split('.')[0].strip()
-    
-    # Extract description (rest of the text)
-    description = '.'.join(text.split('.')[1:]).strip() if len(text.split('.')) > 1 else ""
+    # Extract title (first sentence) and description (rest of the text)
+    head, sep, tail = text.partition('.')
+    title = head.strip()
+    description = tail.strip() if sep else ""
     
     # Extract due date
+    text_lower = text.lower()
     due_date = None
-    date_patterns = [
-        r'к (\d{1,2}(?:ому|ому|ому|ому)? [А-Яа-я]+)',
-        r'до (\d{1,2}(?:ого|ого|ого|ого)? [А-Яа-я]+)',
-        r'завтра',
-        r'на следующей неделе',
-        r'через (\d+) (?:день|дня|дней)',
-        r'через (\d+) (?:неделю|недели|недель)'
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, text.lower())
+    for pattern, resolve in DATE_PATTERNS:
+        match = pattern.search(text_lower)
         if match:
-            if pattern == r'завтра':
-                due_date = datetime.now() + timedelta(days=1)
-            elif pattern == r'на следующей неделе':
-                due_date = datetime.now() + timedelta(days=7)
-            elif pattern == r'через (\d+) (?:день|дня|дней)':
-                days = int(match.group(1))
-                due_date = datetime.now() + timedelta(days=days)
-            elif pattern == r'через (\d+) (?:неделю|недели|недель)':
-                weeks = int(match.group(1))
-                due_date = datetime.now() + timedelta(weeks=weeks)
+            due_date = resolve(match)
             break
     
     # Extract priority
     priority = "medium"
-    priority_indicators = {
-        "high": ["срочно", "срочная", "важно", "важная", "высокий приоритет", "приоритетная"],
-        "low": ["низкий приоритет", "не срочно", "когда будет время", "не приоритетная"]
-    }
-    
-    text_lower = text.lower()
-    for p, indicators in priority_indicators.items():
-        if any(indicator in text_lower for indicator in indicators):
+    for p, pattern in PRIORITY_PATTERNS.items():
+        if pattern.search(text_lower):
             priority = p
             break
     
@@ -66,6 +56,5 @@ def extract_task_info(text: str) -> Tuple[str, str, Optional[datetime], str]:
 
 def extract_user_mention(text: str) -> Optional[str]:
     """Extract username from text if mentioned."""
-    mention_pattern = r'@(\w+)'
-    match = re.search(mention_pattern, text)
+    match = MENTION_PATTERN.search(text)
     return match.group(1) if match else None 
\ No newline at end of file
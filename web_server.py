@@ -1,30 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, func, case, inspect
+from sqlalchemy.orm import Session, sessionmaker
 from datetime import datetime, timedelta
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from jinja2 import Template
+from functools import lru_cache
+from typing import Sequence
+import orjson
+import asyncio
+import hashlib
 import os
 import secrets
+import time
 
 from config import config
-from models import Base, User, Task
+from models import Base, User, Task, TaskDailyStats, TASK_DAY, TASK_PRIORITY
 
 # Initialize FastAPI app
-app = FastAPI(title="Task Analytics")
+# Any endpoint returning a dict is encoded by orjson rather than jsonable_encoder + json
+app = FastAPI(title="Task Analytics", default_response_class=ORJSONResponse)
+
+# The dashboard shell and stats JSON are repetitive text and compress well
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 # Setup HTTP Basic Auth
 security = HTTPBasic()
 
+# Per-process key so credential hashes cannot be precomputed
+CREDENTIALS_KEY = secrets.token_bytes(32)
+
+def hash_credentials(username: str, password: str) -> bytes:
+    return hashlib.blake2b(f"{username}:{password}".encode(), key=CREDENTIALS_KEY).digest()
+
+ADMIN_CREDENTIALS_HASH = hash_credentials("admin", "admin")
+
+@lru_cache(maxsize=1024)
+def credentials_valid(credentials_hash: bytes) -> bool:
+    # Repeat requests from the same browser hit the cache and skip the compare
+    return secrets.compare_digest(credentials_hash, ADMIN_CREDENTIALS_HASH)
+
 def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
-    correct_username = secrets.compare_digest(credentials.username, "admin")
-    correct_password = secrets.compare_digest(credentials.password, "admin")
-    if not (correct_username and correct_password):
+    if not credentials_valid(hash_credentials(credentials.username, credentials.password)):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверные учетные данные",
@@ -33,195 +52,39 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     return credentials.username
 
 # Database setup
-engine = create_engine(config.DATABASE_URL)
+engine_options = dict(
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    future=True,
+)
+if config.DATABASE_URL.startswith("sqlite"):
+    # Sessions are used from FastAPI's threadpool
+    engine_options["connect_args"] = {"check_same_thread": False}
+engine = create_engine(config.DATABASE_URL, **engine_options)
 SessionLocal = sessionmaker(bind=engine)
 
-# Create templates directory if it doesn't exist
-os.makedirs("templates", exist_ok=True)
-
-# Create static directory if it doesn't exist
-os.makedirs("static", exist_ok=True)
-
-# Mount static files
+# Mount static files; static/ ships with the repo, so nothing is created at import
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# HTML template for the dashboard
-dashboard_template = """
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Панель аналитики задач</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
-    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
-    <style>
-        body {
-            background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-            min-height: 100vh;
-            color: #333;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        .container {
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 15px;
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
-            padding: 30px;
-            margin-top: 30px;
-            margin-bottom: 30px;
-        }
-        h1 {
-            color: #1e3c72;
-            font-weight: 600;
-            margin-bottom: 30px;
-            text-align: center;
-        }
-        .card {
-            margin-bottom: 20px;
-            border: none;
-            border-radius: 10px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            transition: transform 0.2s ease-in-out;
-        }
-        .card:hover {
-            transform: translateY(-5px);
-        }
-        .stat-card {
-            text-align: center;
-            padding: 25px;
-            background: linear-gradient(135deg, #ffffff 0%, #f8f9fa 100%);
-        }
-        .stat-value {
-            font-size: 32px;
-            font-weight: bold;
-            color: #1e3c72;
-            margin-bottom: 10px;
-        }
-        .stat-label {
-            color: #666;
-            font-size: 16px;
-            font-weight: 500;
-        }
-        .card-title {
-            color: #1e3c72;
-            font-weight: 600;
-            margin-bottom: 20px;
-        }
-        .table {
-            background: white;
-            border-radius: 10px;
-            overflow: hidden;
-        }
-        .table thead th {
-            background: #1e3c72;
-            color: white;
-            font-weight: 500;
-            border: none;
-        }
-        .table tbody tr:hover {
-            background-color: rgba(30, 60, 114, 0.05);
-        }
-        .table td {
-            vertical-align: middle;
-        }
-    </style>
-</head>
-<body>
-    <div class="container mt-4">
-        <h1 class="mb-4">Панель аналитики задач</h1>
-        
-        <!-- Statistics Cards -->
-        <div class="row mb-4">
-            <div class="col-md-3">
-                <div class="card stat-card">
-                    <div class="stat-value">{{ total_tasks }}</div>
-                    <div class="stat-label">Всего задач</div>
-                </div>
-            </div>
-            <div class="col-md-3">
-                <div class="card stat-card">
-                    <div class="stat-value">{{ completed_tasks }}</div>
-                    <div class="stat-label">Выполнено задач</div>
-                </div>
-            </div>
-            <div class="col-md-3">
-                <div class="card stat-card">
-                    <div class="stat-value">{{ active_users }}</div>
-                    <div class="stat-label">Активных пользователей</div>
-                </div>
-            </div>
-            <div class="col-md-3">
-                <div class="card stat-card">
-                    <div class="stat-value">{{ completion_rate }}%</div>
-                    <div class="stat-label">Процент выполнения</div>
-                </div>
-            </div>
-        </div>
-
-        <!-- Charts -->
-        <div class="row">
-            <div class="col-md-6">
-                <div class="card">
-                    <div class="card-body">
-                        <h5 class="card-title">Задачи по приоритетам</h5>
-                        <div id="priorityChart"></div>
-                    </div>
-                </div>
-            </div>
-            <div class="col-md-6">
-                <div class="card">
-                    <div class="card-body">
-                        <h5 class="card-title">Динамика создания задач</h5>
-                        <div id="timelineChart"></div>
-                    </div>
-                </div>
-            </div>
-        </div>
+# Static page shell, filled in by the browser from /api/stats.
+# Read and encoded once so requests skip the file open and stat.
+DASHBOARD_PAGE = os.path.join("static", "index.html")
+with open(DASHBOARD_PAGE, "rb") as page:
+    DASHBOARD_PAGE_BYTES = page.read()
 
-        <!-- User Activity -->
-        <div class="row mt-4">
-            <div class="col-md-12">
-                <div class="card">
-                    <div class="card-body">
-                        <h5 class="card-title">Активность пользователей</h5>
-                        <div class="table-responsive">
-                            <table class="table">
-                                <thead>
-                                    <tr>
-                                        <th>Пользователь</th>
-                                        <th>Создано задач</th>
-                                        <th>Назначено задач</th>
-                                        <th>Выполнено задач</th>
-                                    </tr>
-                                </thead>
-                                <tbody>
-                                    {% for user in user_stats %}
-                                    <tr>
-                                        <td>@{{ user.username }}</td>
-                                        <td>{{ user.created_tasks }}</td>
-                                        <td>{{ user.assigned_tasks }}</td>
-                                        <td>{{ user.completed_tasks }}</td>
-                                    </tr>
-                                    {% endfor %}
-                                </tbody>
-                            </table>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
+# The shell only changes on deploy, so browsers may reuse it for an hour
+DASHBOARD_PAGE_MAX_AGE = 3600
 
-    <script>
-        // Priority Chart
-        var priorityData = {{ priority_chart | safe }};
-        Plotly.newPlot('priorityChart', priorityData.data, priorityData.layout);
+# Upper bound on points sent for the timeline chart
+TIMELINE_MAX_POINTS = 800
 
-        // Timeline Chart
-        var timelineData = {{ timeline_chart | safe }};
-        Plotly.newPlot('timelineChart', timelineData.data, timelineData.layout);
-    </script>
-</body>
-</html>
-"""
+# Serialized stats shared by all requests for STATS_CACHE_TTL seconds
+STATS_CACHE_TTL = 30
+stats_cache = {"body": None, "etag": None, "expires": 0.0}
+stats_lock = asyncio.Lock()
 
 def get_db():
     db = SessionLocal()
@@ -230,87 +93,167 @@ def get_db():
     finally:
         db.close()
 
-@app.get("/", response_class=HTMLResponse)
-async def dashboard(username: str = Depends(get_current_username)):
-    db = next(get_db())
-    
+def downsample_timeline(dates: Sequence, counts: Sequence, max_points: int = TIMELINE_MAX_POINTS) -> tuple:
+    """Keep the busiest day of each bucket so long histories stay within max_points"""
+    if len(dates) <= max_points:
+        return dates, counts
+    # Exactly max_points buckets, sized n // max_points or one more
+    n = len(dates)
+    sampled_dates, sampled_counts = [], []
+    for i in range(max_points):
+        bucket = range(i * n // max_points, (i + 1) * n // max_points)
+        peak = max(bucket, key=counts.__getitem__)
+        sampled_dates.append(dates[peak])
+        sampled_counts.append(counts[peak])
+    return sampled_dates, sampled_counts
+
+def collect_stats(db: Session) -> dict:
     # Get basic statistics
-    total_tasks = db.query(func.count(Task.id)).scalar()
-    completed_tasks = db.query(func.count(Task.id)).filter(Task.is_completed == True).scalar()
-    active_users = db.query(func.count(User.id)).scalar()
+    total_tasks, completed_tasks, active_users = db.query(
+        func.count(Task.id),
+        func.count(case((Task.is_completed == True, Task.id))),
+        db.query(func.count(User.id)).scalar_subquery()
+    ).one()
     completion_rate = round((completed_tasks / total_tasks * 100) if total_tasks > 0 else 0, 1)
 
+    # Charts read the daily roll-up the bot maintains; until the bot has created and
+    # filled it, aggregate the tasks table directly (an empty roll-up with no tasks
+    # gives the same empty charts either way)
+    if (
+        inspect(db.get_bind()).has_table(TaskDailyStats.__tablename__)
+        and db.query(TaskDailyStats.day).first() is not None
+    ):
+        day, priority, count = TaskDailyStats.day, TaskDailyStats.priority, func.sum(TaskDailyStats.created_count)
+    else:
+        day, priority, count = TASK_DAY, TASK_PRIORITY, func.count(Task.id)
+
     # Get tasks by priority
-    priority_stats = db.query(
-        Task.priority,
-        func.count(Task.id).label('count')
-    ).group_by(Task.priority).all()
+    priority_stats = db.query(priority, count).group_by(priority).all()
+    # Unzip rows into columns in one pass instead of per-row attribute lookups
+    priorities, priority_counts = zip(*priority_stats) if priority_stats else ((), ())
     
+    # Plain trace dicts; plotly.js in the browser does the rendering
     priority_chart = {
         'data': [{
-            'values': [stat.count for stat in priority_stats],
-            'labels': [stat.priority for stat in priority_stats],
             'type': 'pie',
+            'values': priority_counts,
+            'labels': priorities,
             'name': 'Задачи по приоритетам'
         }],
         'layout': {
-            'title': 'Задачи по приоритетам',
+            'title': {'text': 'Задачи по приоритетам'},
             'height': 400
         }
     }
 
     # Get tasks over time
-    tasks_over_time = db.query(
-        func.date(Task.created_at).label('date'),
-        func.count(Task.id).label('count')
-    ).group_by('date').order_by('date').all()
+    tasks_over_time = db.query(day, count).group_by(day).order_by(day).all()
+    dates, counts = zip(*tasks_over_time) if tasks_over_time else ((), ())
+    
+    timeline_dates, timeline_counts = downsample_timeline(dates, counts)
     
     timeline_chart = {
         'data': [{
-            'x': [str(stat.date) for stat in tasks_over_time],
-            'y': [stat.count for stat in tasks_over_time],
             'type': 'scatter',
+            'x': timeline_dates,
+            'y': timeline_counts,
             'mode': 'lines+markers',
             'name': 'Созданные задачи'
         }],
         'layout': {
-            'title': 'Динамика создания задач',
+            'title': {'text': 'Динамика создания задач'},
             'height': 400,
-            'xaxis': {'title': 'Дата'},
-            'yaxis': {'title': 'Количество задач'}
+            'xaxis': {'title': {'text': 'Дата'}},
+            'yaxis': {'title': {'text': 'Количество задач'}}
         }
     }
 
-    # Get user statistics
-    user_stats = []
-    users = db.query(User).all()
-    for user in users:
-        created_tasks = db.query(func.count(Task.id)).filter(Task.creator_id == user.id).scalar()
-        assigned_tasks = db.query(func.count(Task.id)).filter(Task.assignee_id == user.id).scalar()
-        completed_tasks = db.query(func.count(Task.id)).filter(
-            Task.assignee_id == user.id,
-            Task.is_completed == True
-        ).scalar()
-        
-        user_stats.append({
-            'username': user.username,
-            'created_tasks': created_tasks,
-            'assigned_tasks': assigned_tasks,
-            'completed_tasks': completed_tasks
-        })
+    # Get user statistics: per-user counts are grouped once and joined to users
+    created_counts = db.query(
+        Task.creator_id.label('user_id'),
+        func.count(Task.id).label('created_tasks')
+    ).group_by(Task.creator_id).subquery()
+    assigned_counts = db.query(
+        Task.assignee_id.label('user_id'),
+        func.count(Task.id).label('assigned_tasks'),
+        func.count(case((Task.is_completed == True, Task.id))).label('completed_tasks')
+    ).group_by(Task.assignee_id).subquery()
+    
+    user_rows = db.query(
+        User.username,
+        func.coalesce(created_counts.c.created_tasks, 0).label('created_tasks'),
+        func.coalesce(assigned_counts.c.assigned_tasks, 0).label('assigned_tasks'),
+        func.coalesce(assigned_counts.c.completed_tasks, 0).label('completed_tasks')
+    ).outerjoin(
+        created_counts, created_counts.c.user_id == User.id
+    ).outerjoin(
+        assigned_counts, assigned_counts.c.user_id == User.id
+    ).order_by(User.id).all()
+    
+    user_stats = [
+        {
+            'username': row.username,
+            'created_tasks': row.created_tasks,
+            'assigned_tasks': row.assigned_tasks,
+            'completed_tasks': row.completed_tasks
+        }
+        for row in user_rows
+    ]
+
+    return {
+        'total_tasks': total_tasks,
+        'completed_tasks': completed_tasks,
+        'active_users': active_users,
+        'completion_rate': completion_rate,
+        'priority_chart': priority_chart,
+        'timeline_chart': timeline_chart,
+        'user_stats': user_stats
+    }
 
-    # Render template
-    template = Template(dashboard_template)
-    return template.render(
-        total_tasks=total_tasks,
-        completed_tasks=completed_tasks,
-        active_users=active_users,
-        completion_rate=completion_rate,
-        priority_chart=priority_chart,
-        timeline_chart=timeline_chart,
-        user_stats=user_stats
+@app.get("/", response_class=HTMLResponse)
+async def dashboard(username: str = Depends(get_current_username)):
+    return HTMLResponse(
+        DASHBOARD_PAGE_BYTES,
+        headers={"Cache-Control": f"private, max-age={DASHBOARD_PAGE_MAX_AGE}"}
     )
 
+@app.get("/api/stats")
+async def api_stats(
+    request: Request,
+    username: str = Depends(get_current_username),
+    db: Session = Depends(get_db)
+):
+    # Serve the cached stats while fresh; the lock makes concurrent misses query once.
+    # Collecting runs blocking DB queries, so it happens in the threadpool.
+    async with stats_lock:
+        if time.monotonic() >= stats_cache["expires"]:
+            stats = await run_in_threadpool(collect_stats, db)
+            body = orjson.dumps(stats)
+            stats_cache.update(
+                body=body,
+                etag='"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"',
+                expires=time.monotonic() + STATS_CACHE_TTL
+            )
+    
+    headers = {
+        "Cache-Control": f"private, max-age={STATS_CACHE_TTL}",
+        "ETag": stats_cache["etag"]
+    }
+    if request.headers.get("if-none-match") == stats_cache["etag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # Body is already orjson-encoded, so bypass render() and send the cached bytes
+    return Response(stats_cache["body"], media_type=ORJSONResponse.media_type, headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=7000) 
\ No newline at end of file
+    # Import string so uvicorn can spawn one worker process per core
+    uvicorn.run(
+        "web_server:app",
+        host="0.0.0.0",
+        port=7000,
+        # uvloop when installed (not on Windows), asyncio otherwise
+        loop="auto",
+        http="httptools",
+        workers=config.WEB_WORKERS,
+        backlog=2048
+    ) 
\ No newline at end of file